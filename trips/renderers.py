@@ -0,0 +1,31 @@
+from decimal import Decimal
+
+import orjson
+from django.utils.functional import Promise
+from rest_framework.renderers import BaseRenderer
+
+
+def _default(obj):
+    """
+    Types DRF's JSONRenderer knows and orjson does not; anything else is a
+    bug and fails like it would with JSONRenderer.
+    """
+    if isinstance(obj, Promise):
+        return str(obj)
+    if isinstance(obj, Decimal):
+        return float(obj)
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+class ORJSONRenderer(BaseRenderer):
+    """
+    JSON renderer backed by orjson, which serializes straight to bytes.
+    """
+    media_type = "application/json"
+    format = "json"
+    charset = None
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b""
+        return orjson.dumps(data, default=_default)
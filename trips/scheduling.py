@@ -1,4 +1,6 @@
-from datetime import datetime, timedelta
+import sys
+import time
+from functools import lru_cache
 
 # --- Constants ---
 AVG_SPEED_MPH = 55.0
@@ -13,150 +15,216 @@ OFF_DUTY_RESET_HRS = 10.0
 CYCLE_LIMIT_HRS = 70.0
 RESTART_OFF_DUTY_HRS = 34.0
 
-
-def compute_schedule_for_route(route_geojson: dict, current_cycle_used_hours: float):
-    """
-    Generate a realistic FMCSA HOS-compliant trip schedule
-    based on route distance/duration.
+# --- Precomputed values for the driving loop ---
+MILES_PER_METER = 1 / 1609.34
+HOURS_PER_MILE = 1 / AVG_SPEED_MPH
+HALF_HR_SEC = 1800
+PICKUP_SEC = PICKUP_MIN * 60
+DROPOFF_SEC = DROPOFF_MIN * 60
+FUEL_STOP_SEC = FUEL_STOP_MIN * 60
+BREAK_SEC = int(BREAK_AFTER_HRS * 3600)
+RESET_SEC = int(OFF_DUTY_RESET_HRS * 3600)
+RESTART_SEC = int(RESTART_OFF_DUTY_HRS * 3600)
+MAX_DRIVE_SEC = int(MAX_DRIVE_HRS * 3600)
+MAX_ON_DUTY_SEC = int(MAX_ON_DUTY_HRS * 3600)
+CYCLE_LIMIT_SEC = int(CYCLE_LIMIT_HRS * 3600)
+FUEL_RANGE_SEC = round(FUEL_RANGE_MILES * HOURS_PER_MILE * 3600)
+MILES_PER_SEC = AVG_SPEED_MPH / 3600
+
+# --- Status / note codes used by the simulation core ---
+DRIVING, OFF_DUTY, SLEEPER, ON_DUTY_ND = range(4)
+STATUSES = tuple(map(sys.intern, ("Driving", "OffDuty", "Sleeper", "OnDutyNotDriving")))
+
+(NOTE_PRE_TRIP, NOTE_DRIVE_TO_PICKUP, NOTE_PICKUP, NOTE_BREAK, NOTE_SPLIT_SLEEPER,
+ NOTE_SPLIT_OFF_DUTY, NOTE_RESET, NOTE_RESTART, NOTE_DRIVE, NOTE_FUEL,
+ NOTE_UNLOAD, NOTE_REST_AFTER_TRIP) = range(12)
+NOTES = tuple(map(sys.intern, (
+    "Pre-trip inspection",
+    "Drive {:.0f} mi to pickup",
+    "Pickup cargo",
+    "30 min mandatory break (after 8 hrs driving)",
+    "Sleeper berth (split rest)",
+    "Off-duty completion of split rest",
+    "10 hr off-duty reset (11/14 hr rule)",
+    "34 hr restart (70 hr / 8-day rule)",
+    "Drive {:.0f} mi",
+    "Fuel stop",
+    "Unload cargo",
+    "10 hr rest after trip",
+)))
+
+
+@lru_cache(maxsize=1024)
+def _simulate_hos(first_leg_mi: float, remaining_miles: float, cycle_used: float):
     """
-    features = route_geojson.get("features", [])
-    if not features:
-        return {"schedule": [], "total_miles": 0, "estimated_drive_hours": 0}
+    Run the HOS state machine on plain numbers only.
 
-    # --- Sum all segments for total distance and duration ---
-    props = features[0]["properties"]
-    segments = props.get("segments", [])
-    total_meters = sum(seg["distance"] for seg in segments)
-    total_seconds = sum(seg["duration"] for seg in segments)
+    Each driving phase runs until the next rule kicks in (break, daily limit,
+    cycle limit, fuel or arrival) and is emitted as a single entry, so the
+    loop is proportional to the number of phases rather than the miles.
 
-    total_miles = total_meters / 1609.34
-    est_drive_hours = total_seconds / 3600.0
+    The result only depends on the arguments, so it is memoized; callers
+    quantize the inputs to make repeat trips hit the cache.
 
-    # --- Initialize schedule ---
-    now = datetime.utcnow()
-    t = now
-    schedule = []
+    Returns a tuple of (status, start offset, end offset, note,
+    miles since start) tuples, with offsets in seconds; wall-clock times
+    are filled in by the caller. Labels and notes are resolved here so a
+    cache hit reuses the same string objects.
+    """
+    rows = []
 
+    # Counters are kept in whole seconds so limits are hit exactly
+    t_sec = 0
     miles_driven = 0.0
     driving_today = on_duty_today = driving_since_break = 0
-    cycle_used = current_cycle_used_hours
-    miles_until_fuel = FUEL_RANGE_MILES
-
-    # --- Helper to append schedule entry ---
-    def append(status, start, end, note=""):
-        schedule.append({
-            "status": status,
-            "start": start.isoformat() + "Z",
-            "end": end.isoformat() + "Z",
-            "note": note,
-            "miles_since_start": miles_driven
-        })
+    cycle_sec = round(cycle_used * 3600)
+    fuel_left_sec = FUEL_RANGE_SEC
+    remaining_sec = round(remaining_miles * HOURS_PER_MILE * 3600)
 
     # --- Pre-trip inspection ---
-    append("OnDutyNotDriving", t, t + timedelta(minutes=30), "Pre-trip inspection")
-    t += timedelta(minutes=30)
-    on_duty_today += 0.5
-    cycle_used += 0.5
-
-    # --- Drive from current location to pickup ---
-    if segments:
-        first_leg_distance_mi = segments[0]["distance"] / 1609.34
-        hours_to_pickup = first_leg_distance_mi / AVG_SPEED_MPH
-        append("Driving", t, t + timedelta(hours=hours_to_pickup),
-               f"Drive {first_leg_distance_mi:.0f} mi to pickup")
-        t += timedelta(hours=hours_to_pickup)
-        miles_driven += first_leg_distance_mi
-        driving_since_break += hours_to_pickup
-        driving_today += hours_to_pickup
-        on_duty_today += hours_to_pickup
-        cycle_used += hours_to_pickup
+    rows.append((ON_DUTY_ND, t_sec, t_sec + HALF_HR_SEC, NOTE_PRE_TRIP, miles_driven, 0.0))
+    t_sec += HALF_HR_SEC
+    on_duty_today += HALF_HR_SEC
+    cycle_sec += HALF_HR_SEC
+
+    # --- Drive from current location to pickup (kept even when ~0 mi) ---
+    leg_sec = round(first_leg_mi * HOURS_PER_MILE * 3600)
+    rows.append((DRIVING, t_sec, t_sec + leg_sec, NOTE_DRIVE_TO_PICKUP, miles_driven, first_leg_mi))
+    t_sec += leg_sec
+    miles_driven += first_leg_mi
+    driving_since_break += leg_sec
+    driving_today += leg_sec
+    on_duty_today += leg_sec
+    cycle_sec += leg_sec
 
     # --- Pickup cargo ---
-    append("OnDutyNotDriving", t, t + timedelta(minutes=PICKUP_MIN), "Pickup cargo")
-    t += timedelta(minutes=PICKUP_MIN)
-    on_duty_today += PICKUP_MIN / 60
-    cycle_used += PICKUP_MIN / 60
-
-    # --- Remaining distance after pickup ---
-    remaining_miles = sum(seg["distance"] for seg in segments[1:]) / 1609.34
+    rows.append((ON_DUTY_ND, t_sec, t_sec + PICKUP_SEC, NOTE_PICKUP, miles_driven, 0.0))
+    t_sec += PICKUP_SEC
+    on_duty_today += PICKUP_SEC
+    cycle_sec += PICKUP_SEC
 
     # --- Driving simulation ---
-    while remaining_miles > 0:
+    while remaining_sec > 0:
         # Mandatory 30 min break after 8 hours driving
-        if driving_since_break >= BREAK_AFTER_HRS:
-            append("OffDuty", t, t + timedelta(minutes=30),
-                   "30 min mandatory break (after 8 hrs driving)")
-            t += timedelta(minutes=30)
+        if driving_since_break >= BREAK_SEC:
+            rows.append((OFF_DUTY, t_sec, t_sec + HALF_HR_SEC, NOTE_BREAK, miles_driven, 0.0))
+            t_sec += HALF_HR_SEC
             driving_since_break = 0
             continue
 
         # Max drive/on-duty rules
-        if driving_today >= MAX_DRIVE_HRS or on_duty_today >= MAX_ON_DUTY_HRS:
+        if driving_today >= MAX_DRIVE_SEC or on_duty_today >= MAX_ON_DUTY_SEC:
+            remaining_miles = remaining_sec * MILES_PER_SEC
             if remaining_miles > 50:
-                s1 = min(7, MAX_ON_DUTY_HRS - on_duty_today)
-                sb_start, sb_end = t, t + timedelta(hours=s1)
-                append("Sleeper", sb_start, sb_end, "Sleeper berth (split rest)")
-                t = sb_end
-                driving_today = on_duty_today = driving_since_break = 0
-                cycle_used += s1
-
-                s2 = min(3, OFF_DUTY_RESET_HRS)
+                s1 = min(7 * 3600, MAX_ON_DUTY_SEC - on_duty_today)
+                rows.append((SLEEPER, t_sec, t_sec + s1, NOTE_SPLIT_SLEEPER, miles_driven, 0.0))
+                t_sec += s1
+                cycle_sec += s1
+
+                s2 = min(3 * 3600, RESET_SEC)
                 if remaining_miles > 100:
-                    rest_start, rest_end = t, t + timedelta(hours=s2)
-                    append("OffDuty", rest_start, rest_end,
-                           "Off-duty completion of split rest")
-                    t = rest_end
-                    cycle_used += s2
+                    rows.append((OFF_DUTY, t_sec, t_sec + s2, NOTE_SPLIT_OFF_DUTY, miles_driven, 0.0))
+                    t_sec += s2
+                    cycle_sec += s2
             else:
-                reset_start, reset_end = t, t + timedelta(hours=OFF_DUTY_RESET_HRS)
-                append("OffDuty", reset_start, reset_end,
-                       "10 hr off-duty reset (11/14 hr rule)")
-                t = reset_end
-                cycle_used += OFF_DUTY_RESET_HRS
+                rows.append((OFF_DUTY, t_sec, t_sec + RESET_SEC, NOTE_RESET, miles_driven, 0.0))
+                t_sec += RESET_SEC
+                cycle_sec += RESET_SEC
 
             driving_today = on_duty_today = driving_since_break = 0
             continue
 
         # Cycle limit check
-        if cycle_used >= CYCLE_LIMIT_HRS:
-            append("OffDuty", t, t + timedelta(hours=RESTART_OFF_DUTY_HRS),
-                   "34 hr restart (70 hr / 8-day rule)")
-            t += timedelta(hours=RESTART_OFF_DUTY_HRS)
-            cycle_used = 0
+        if cycle_sec >= CYCLE_LIMIT_SEC:
+            rows.append((OFF_DUTY, t_sec, t_sec + RESTART_SEC, NOTE_RESTART, miles_driven, 0.0))
+            t_sec += RESTART_SEC
+            cycle_sec = 0
             continue
 
-        # Driving leg
-        miles_this_leg = min(remaining_miles, AVG_SPEED_MPH)
-        hours_this_leg = miles_this_leg / AVG_SPEED_MPH
-        hours_this_leg = min(hours_this_leg, MAX_DRIVE_HRS - driving_today,
-                             MAX_ON_DUTY_HRS - on_duty_today)
+        # Driving phase: drive until the nearest limit or the destination
+        leg_sec = min(remaining_sec,
+                      BREAK_SEC - driving_since_break,
+                      MAX_DRIVE_SEC - driving_today,
+                      MAX_ON_DUTY_SEC - on_duty_today,
+                      CYCLE_LIMIT_SEC - cycle_sec,
+                      fuel_left_sec)
+        miles_this_leg = leg_sec * MILES_PER_SEC
 
-        drive_start, drive_end = t, t + timedelta(hours=hours_this_leg)
-        append("Driving", drive_start, drive_end, f"Drive {miles_this_leg:.0f} mi")
-        t = drive_end
+        rows.append((DRIVING, t_sec, t_sec + leg_sec, NOTE_DRIVE, miles_driven, miles_this_leg))
+        t_sec += leg_sec
 
-        remaining_miles -= miles_this_leg
+        remaining_sec -= leg_sec
         miles_driven += miles_this_leg
-        driving_today += hours_this_leg
-        on_duty_today += hours_this_leg
-        driving_since_break += hours_this_leg
-        cycle_used += hours_this_leg
-        miles_until_fuel -= miles_this_leg
+        driving_today += leg_sec
+        on_duty_today += leg_sec
+        driving_since_break += leg_sec
+        cycle_sec += leg_sec
+        fuel_left_sec -= leg_sec
 
         # Fuel stop
-        if miles_until_fuel <= 0 and remaining_miles > 0:
-            fuel_start, fuel_end = t, t + timedelta(minutes=FUEL_STOP_MIN)
-            append("OnDutyNotDriving", fuel_start, fuel_end, "Fuel stop")
-            t = fuel_end
-            on_duty_today += FUEL_STOP_MIN / 60
-            cycle_used += FUEL_STOP_MIN / 60
-            miles_until_fuel = FUEL_RANGE_MILES
+        if fuel_left_sec <= 0 and remaining_sec > 0:
+            rows.append((ON_DUTY_ND, t_sec, t_sec + FUEL_STOP_SEC, NOTE_FUEL, miles_driven, 0.0))
+            t_sec += FUEL_STOP_SEC
+            on_duty_today += FUEL_STOP_SEC
+            cycle_sec += FUEL_STOP_SEC
+            fuel_left_sec = FUEL_RANGE_SEC
 
     # --- Dropoff & Post-trip ---
-    append("OnDutyNotDriving", t, t + timedelta(minutes=DROPOFF_MIN), "Unload cargo")
-    t += timedelta(minutes=DROPOFF_MIN)
-    append("OffDuty", t, t + timedelta(hours=OFF_DUTY_RESET_HRS),
-           "10 hr rest after trip")
+    rows.append((ON_DUTY_ND, t_sec, t_sec + DROPOFF_SEC, NOTE_UNLOAD, miles_driven, 0.0))
+    t_sec += DROPOFF_SEC
+    rows.append((OFF_DUTY, t_sec, t_sec + RESET_SEC, NOTE_REST_AFTER_TRIP, miles_driven, 0.0))
+
+    return tuple(
+        (STATUSES[status], start_sec, end_sec, NOTES[note].format(leg_miles), miles)
+        for status, start_sec, end_sec, note, miles, leg_miles in rows
+    )
+
+
+def _iso(base_ts: int, offset_sec: int) -> str:
+    """UTC ISO-8601 timestamp (second precision) for base_ts + offset_sec."""
+    return time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(base_ts + offset_sec))
+
+
+def iter_schedule(total_meters: float, first_leg_meters: float,
+                  current_cycle_used_hours: float):
+    """
+    Iterator over the schedule entries, stamped from the current time.
+
+    The simulation runs eagerly so bad input fails here rather than midway
+    through a streamed response; only the entry dicts are built lazily.
+    """
+    # --- Run the simulation (miles quantized to 1 mi, cycle to 0.1 hr) ---
+    rows = _simulate_hos(
+        round(first_leg_meters * MILES_PER_METER),
+        round((total_meters - first_leg_meters) * MILES_PER_METER),
+        round(float(current_cycle_used_hours), 1),
+    )
+
+    base_ts = int(time.time())
+    return (
+        {
+            "status": status,
+            "start": _iso(base_ts, start_sec),
+            "end": _iso(base_ts, end_sec),
+            "note": note,
+            "miles_since_start": miles,
+        }
+        for status, start_sec, end_sec, note, miles in rows
+    )
+
+
+def compute_schedule_for_route(total_meters: float, first_leg_meters: float,
+                               total_seconds: float, current_cycle_used_hours: float):
+    """
+    Generate a realistic FMCSA HOS-compliant trip schedule
+    based on route distance/duration.
+
+    Takes the route totals (all segments) and the distance of the first
+    segment, i.e. the leg from the current location to the pickup.
+    """
+    total_miles = total_meters * MILES_PER_METER
+    est_drive_hours = total_seconds / 3600.0
+    schedule = list(iter_schedule(total_meters, first_leg_meters, current_cycle_used_hours))
 
     return {
         "schedule": schedule,
@@ -1,3 +1,285 @@
-from django.test import TestCase
+import os
+import re
+import threading
+import time
+from datetime import datetime
+from decimal import Decimal
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
 
-# Create your tests here.
+import orjson
+import requests
+from django.core.cache import cache
+from django.test import SimpleTestCase, override_settings
+from django.urls import reverse
+from django.utils.translation import gettext_lazy
+from urllib3.exceptions import MaxRetryError, ReadTimeoutError
+
+from . import views
+from .renderers import ORJSONRenderer
+from .scheduling import (
+    BREAK_SEC, CYCLE_LIMIT_SEC, FUEL_RANGE_MILES, HALF_HR_SEC, MAX_DRIVE_SEC,
+    PICKUP_SEC, RESET_SEC, RESTART_SEC, compute_schedule_for_route,
+)
+
+BREAK = "30 min mandatory break (after 8 hrs driving)"
+RESET = "10 hr off-duty reset (11/14 hr rule)"
+SPLIT_SLEEPER = "Sleeper berth (split rest)"
+SPLIT_OFF_DUTY = "Off-duty completion of split rest"
+RESTART = "34 hr restart (70 hr / 8-day rule)"
+FUEL = "Fuel stop"
+
+
+def schedule(first_leg_mi, remaining_mi, cycle_used=0.0):
+    """Schedule entries for a route with the given legs, in miles."""
+    first_leg_m = first_leg_mi * 1609.34
+    total_m = first_leg_m + remaining_mi * 1609.34
+    return compute_schedule_for_route(total_m, first_leg_m, 0.0, cycle_used)["schedule"]
+
+
+def seconds(entry):
+    start = datetime.fromisoformat(entry["start"].rstrip("Z"))
+    end = datetime.fromisoformat(entry["end"].rstrip("Z"))
+    return int((end - start).total_seconds())
+
+
+def notes(entries):
+    return [entry["note"] for entry in entries]
+
+
+def driving_sec_before(entries, note):
+    """Seconds driven before the first entry with the given note."""
+    total = 0
+    for entry in entries:
+        if entry["note"] == note:
+            return total
+        if entry["status"] == "Driving":
+            total += seconds(entry)
+    raise AssertionError(f"no {note!r} entry")
+
+
+class ScheduleTests(SimpleTestCase):
+    def test_entries_are_contiguous(self):
+        entries = schedule(100, 2500, 10.0)
+        for prev, entry in zip(entries, entries[1:]):
+            self.assertEqual(prev["end"], entry["start"])
+
+    def test_entry_keys(self):
+        for entry in schedule(100, 500):
+            self.assertEqual(
+                set(entry), {"status", "start", "end", "note", "miles_since_start"}
+            )
+
+    def test_timestamps_are_utc_seconds(self):
+        iso = re.compile(r"^\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}Z$")
+        for entry in schedule(100, 500):
+            self.assertRegex(entry["start"], iso)
+            self.assertRegex(entry["end"], iso)
+
+    def test_zero_remaining_miles(self):
+        self.assertEqual(notes(schedule(10, 0)), [
+            "Pre-trip inspection", "Drive 10 mi to pickup", "Pickup cargo",
+            "Unload cargo", "10 hr rest after trip",
+        ])
+
+    def test_short_first_leg_keeps_pickup_drive(self):
+        # Driver is already at the pickup: 0.2 mi rounds to 0 mi
+        entries = schedule(0.2, 100)
+        self.assertEqual(entries[1]["status"], "Driving")
+        self.assertEqual(entries[1]["note"], "Drive 0 mi to pickup")
+
+    def test_break_after_8_hours_driving(self):
+        entries = schedule(10, 600)
+        self.assertEqual(driving_sec_before(entries, BREAK), BREAK_SEC)
+        self.assertEqual(seconds(entries[notes(entries).index(BREAK)]), HALF_HR_SEC)
+
+    def test_off_duty_reset_when_close_to_destination(self):
+        # 11 h of driving covers 605 mi, leaving 30 mi
+        entries = schedule(10, 625)
+        self.assertEqual(driving_sec_before(entries, RESET), MAX_DRIVE_SEC)
+        self.assertEqual(seconds(entries[notes(entries).index(RESET)]), RESET_SEC)
+        self.assertNotIn(SPLIT_SLEEPER, notes(entries))
+
+    def test_split_rest_after_11_hours_driving(self):
+        entries = schedule(10, 790)
+        self.assertEqual(driving_sec_before(entries, SPLIT_SLEEPER), MAX_DRIVE_SEC)
+        sleeper = notes(entries).index(SPLIT_SLEEPER)
+        self.assertEqual(entries[sleeper]["status"], "Sleeper")
+        self.assertEqual(entries[sleeper + 1]["note"], SPLIT_OFF_DUTY)
+
+    def test_restart_before_driving_when_cycle_exhausted(self):
+        entries = schedule(10, 100, 69.0)
+        self.assertEqual(entries[3]["note"], RESTART)
+        self.assertEqual(seconds(entries[3]), RESTART_SEC)
+
+    def test_driving_stops_at_cycle_limit(self):
+        # 66.1 h is one of the values where int(hours * 3600) truncates
+        for cycle_used in (66.0, 66.1):
+            with self.subTest(cycle_used=cycle_used):
+                entries = schedule(10, 500, cycle_used)
+                self.assertEqual(
+                    driving_sec_before(entries, RESTART),
+                    CYCLE_LIMIT_SEC - round(cycle_used * 3600) - HALF_HR_SEC - PICKUP_SEC,
+                )
+
+    def test_fuel_stop_every_1000_miles(self):
+        entries = schedule(10, 1100)
+        fuel = [entry for entry in entries if entry["note"] == FUEL]
+        self.assertEqual(len(fuel), 1)
+        # The range counts from the pickup
+        self.assertAlmostEqual(fuel[0]["miles_since_start"], 10 + FUEL_RANGE_MILES, delta=0.1)
+
+    def test_no_fuel_stop_on_arrival(self):
+        self.assertNotIn(FUEL, notes(schedule(10, FUEL_RANGE_MILES)))
+
+
+class ORJSONRendererTests(SimpleTestCase):
+    def test_renders_lazy_strings_and_decimals(self):
+        data = {"error": gettext_lazy("Not found."), "miles": Decimal("1.5")}
+        self.assertEqual(
+            ORJSONRenderer().render(data), b'{"error":"Not found.","miles":1.5}'
+        )
+
+    def test_unknown_objects_fail(self):
+        with self.assertRaises(TypeError):
+            ORJSONRenderer().render({"trip": object()})
+
+
+class RateLimitedORS(BaseHTTPRequestHandler):
+    """Answers every request with the class status and a long Retry-After."""
+    status = 429
+    hits = 0
+
+    def do_POST(self):
+        type(self).hits += 1
+        self.rfile.read(int(self.headers["Content-Length"]))
+        self.send_response(self.status)
+        self.send_header("Retry-After", "4")
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+@override_settings(CACHES={
+    "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}
+})
+@mock.patch.dict(os.environ, {"ORS_API_KEY": "test-key"})
+class PlanTripTests(SimpleTestCase):
+    payload = {
+        "current_location": {"lat": 40.0, "lng": -75.0},
+        "pickup_location": {"lat": 40.5, "lng": -75.5},
+        "dropoff_location": {"lat": 41.0, "lng": -76.0},
+        "current_cycle_used_hours": 10,
+    }
+    route = {"features": [{"properties": {"segments": [
+        {"distance": 70_000.0, "duration": 3_600.0},
+        {"distance": 90_000.0, "duration": 4_800.0},
+    ]}}]}
+
+    def setUp(self):
+        cache.clear()
+
+    def post(self, name="plan-trip"):
+        return self.client.post(reverse(name), self.payload, content_type="application/json")
+
+    def ors_response(self, body):
+        return mock.Mock(status_code=200, content=orjson.dumps(body), text="")
+
+    def test_valid_route_is_cached(self):
+        with mock.patch.object(
+            views.ors_session, "post", return_value=self.ors_response(self.route)
+        ) as post:
+            self.assertEqual(self.post().status_code, 200)
+            res = self.post()
+        self.assertEqual(post.call_count, 1)
+        self.assertEqual(res.json()["summary"]["distance_km"], 70.0)
+
+    def test_read_timeout_returns_504(self):
+        error = requests.ConnectionError(
+            MaxRetryError(None, "/", ReadTimeoutError(None, "/", "Read timed out."))
+        )
+        with mock.patch.object(views.ors_session, "post", side_effect=error):
+            res = self.post()
+        self.assertEqual(res.status_code, 504)
+        self.assertEqual(res.json(), {"error": "ORS request timed out"})
+
+    def test_connection_error_returns_502(self):
+        with mock.patch.object(
+            views.ors_session, "post", side_effect=requests.ConnectionError("refused")
+        ):
+            res = self.post()
+        self.assertEqual(res.status_code, 502)
+        self.assertEqual(res.json(), {"error": "ORS unreachable"})
+
+    def test_retry_after_does_not_hold_the_request(self):
+        # 429 is not retried at all; 503 is, but without sleeping for Retry-After
+        for status, attempts in ((429, 1), (503, 3)):
+            with self.subTest(status=status):
+                handler = type("Handler", (RateLimitedORS,), {"status": status})
+                server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+                threading.Thread(target=server.serve_forever, daemon=True).start()
+                self.addCleanup(server.server_close)
+                self.addCleanup(server.shutdown)
+
+                url = f"http://127.0.0.1:{server.server_port}/"
+                adapter = views.ors_session.get_adapter("https://")
+                with mock.patch.object(views, "ORS_DIRECTIONS_URL", url), \
+                        mock.patch.dict(views.ors_session.adapters, {"http://": adapter}):
+                    started = time.monotonic()
+                    res = self.post()
+                    elapsed = time.monotonic() - started
+
+                self.assertNotEqual(res.status_code, 200)
+                self.assertEqual(handler.hits, attempts)
+                self.assertLess(elapsed, 2)
+
+    def test_stream_returns_one_entry_per_line(self):
+        with mock.patch.object(
+            views.ors_session, "post", return_value=self.ors_response(self.route)
+        ):
+            res = self.post("plan-trip-stream")
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res["Content-Type"], "application/x-ndjson")
+
+        lines = b"".join(res.streaming_content).splitlines()
+        entries = [orjson.loads(line) for line in lines]
+        self.assertEqual(entries[0]["note"], "Pre-trip inspection")
+        self.assertEqual(entries[-1]["note"], "10 hr rest after trip")
+        for entry in entries:
+            self.assertEqual(
+                set(entry), {"status", "start", "end", "note", "miles_since_start"}
+            )
+
+    def test_stream_errors_are_plain_json(self):
+        with mock.patch.object(
+            views.ors_session, "post", side_effect=requests.ConnectTimeout("slow")
+        ):
+            res = self.post("plan-trip-stream")
+        self.assertFalse(res.streaming)
+        self.assertEqual(res.status_code, 504)
+        self.assertEqual(res.json(), {"error": "ORS request timed out"})
+
+    def test_malformed_routes_return_502_and_are_not_cached(self):
+        bodies = [
+            b"<html>Bad gateway</html>",
+            orjson.dumps({}),
+            orjson.dumps({"features": {"0": {}}}),
+            orjson.dumps({"features": ["oops"]}),
+            orjson.dumps({"features": [{"properties": {"segments": []}}]}),
+            orjson.dumps({"features": [{"properties": {"segments": [{"distance": 1.0}]}}]}),
+            orjson.dumps({"features": [{"properties": {"segments": [
+                {"distance": "1", "duration": 1},
+            ]}}]}),
+        ]
+        for body in bodies:
+            ors_res = mock.Mock(status_code=200, content=body, text="")
+            with self.subTest(body=body), mock.patch.object(
+                views.ors_session, "post", return_value=ors_res
+            ) as post:
+                for name in ("plan-trip", "plan-trip", "plan-trip-stream"):
+                    res = self.post(name)
+                    self.assertEqual(res.status_code, 502)
+                    self.assertEqual(res.json(), {"error": "Malformed ORS response"})
+                self.assertEqual(post.call_count, 3)
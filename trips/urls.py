@@ -3,4 +3,5 @@ from . import views
 
 urlpatterns = [
     path("plan-trip/", views.plan_trip, name="plan-trip"),
+    path("plan-trip/stream/", views.plan_trip_stream, name="plan-trip-stream"),
 ]
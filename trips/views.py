@@ -1,48 +1,221 @@
+from django.core.cache import cache
+from django.http import HttpResponse, StreamingHttpResponse
 from rest_framework.decorators import api_view
 from rest_framework.response import Response
-import requests, os
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import ReadTimeoutError
+from urllib3.util.retry import Retry
+import requests, os, json, hashlib, logging, orjson
 from datetime import datetime
-from .scheduling import compute_schedule_for_route
+from .scheduling import compute_schedule_for_route, iter_schedule
 
-@api_view(["POST"])
-def plan_trip(request):
+logger = logging.getLogger(__name__)
+
+ORS_DIRECTIONS_URL = "https://api.openrouteservice.org/v2/directions/driving-car/geojson"
+ORS_CACHE_TTL = 60 * 60 * 24  # 1 day
+ORS_TIMEOUT = (3.0, 12.0)  # (connect, read) seconds
+
+# Prebuilt bodies for the ORS failure responses
+MALFORMED_ROUTE_BODY = orjson.dumps({"error": "Malformed ORS response"})
+ORS_TIMEOUT_BODY = orjson.dumps({"error": "ORS request timed out"})
+ORS_UNREACHABLE_BODY = orjson.dumps({"error": "ORS unreachable"})
+
+# Shared keep-alive session so TCP/TLS connections to ORS are reused across
+# requests. Connect failures and transient gateway errors are retried; read
+# timeouts are not, and Retry-After is ignored, so a hung or rate-limited
+# ORS never holds a thread longer than one timeout plus a short backoff
+ors_session = requests.Session()
+ors_session.mount("https://", HTTPAdapter(
+    pool_connections=32,
+    pool_maxsize=32,
+    max_retries=Retry(
+        total=2,
+        connect=2,
+        read=0,
+        backoff_factor=0.2,
+        status_forcelist=[502, 503, 504],
+        allowed_methods=["POST"],
+        respect_retry_after_header=False,
+        raise_on_status=False,
+    ),
+))
+
+
+def route_cache_key(coords):
+    """
+    Cache key for an ORS route, with coordinates rounded to 5 decimals (~1 m)
+    so near-identical trips share the same entry.
+    """
+    coords_rounded = [[round(float(c), 5) for c in point] for point in coords]
+    digest = hashlib.blake2b(json.dumps(coords_rounded).encode(), digest_size=16)
+    return "ors:" + digest.hexdigest()
+
+
+def cached_route(cache_key):
+    """
+    Cached ORS route, or None on a miss or when the cache backend is down.
+    """
+    try:
+        return cache.get(cache_key)
+    except Exception as e:
+        logger.warning("Route cache read failed: %s", e)
+        return None
+
+
+def cache_route(cache_key, route_data):
+    """
+    Store an ORS route; a cache outage only costs the next lookup a miss.
+    """
+    try:
+        cache.set(cache_key, route_data, ORS_CACHE_TTL)
+    except Exception as e:
+        logger.warning("Route cache write failed: %s", e)
+
+
+def route_segments(route_data):
+    """
+    Segments of the first route feature, or None if the ORS payload does
+    not have the shape the views read: a non-empty list of dicts with
+    numeric "distance" and "duration".
+    """
+    if not isinstance(route_data, dict):
+        return None
+    features = route_data.get("features")
+    if not isinstance(features, list) or not features or not isinstance(features[0], dict):
+        return None
+    properties = features[0].get("properties")
+    if not isinstance(properties, dict):
+        return None
+    segments = properties.get("segments")
+    if not isinstance(segments, list) or not segments:
+        return None
+    for seg in segments:
+        if not isinstance(seg, dict):
+            return None
+        for key in ("distance", "duration"):
+            value = seg.get(key)
+            if not isinstance(value, (int, float)) or isinstance(value, bool):
+                return None
+    return segments
+
+
+def malformed_route_response():
+    """
+    502 for an unusable ORS payload, served from the prebuilt body.
+    """
+    logger.warning("Malformed ORS response")
+    return HttpResponse(MALFORMED_ROUTE_BODY, status=502, content_type="application/json")
+
+
+def ors_timed_out(exc):
+    """
+    Whether a requests exception is a timeout; with read retries disabled,
+    urllib3 reports read timeouts as a ConnectionError wrapping MaxRetryError.
+    """
+    if isinstance(exc, requests.Timeout):
+        return True
+    reason = getattr(exc.args[0], "reason", None) if exc.args else None
+    return isinstance(reason, ReadTimeoutError)
+
+
+def segment_totals(segments):
+    """
+    Total distance (m) and duration (s) over all route segments.
+    """
+    total_meters = total_seconds = 0.0
+    for seg in segments:
+        total_meters += seg["distance"]
+        total_seconds += seg["duration"]
+    return total_meters, total_seconds
+
+
+def fetch_route(data):
     """
     Calls OpenRouteService Directions API to compute a real route
     between the current, pickup, and dropoff locations.
+
+    Returns (route_data, None) on success, or (None, error_response).
+    Malformed payloads are not cached.
     """
-    data = request.data
-    print("Received trip data:", data)
+    # 1. Extract coordinates (all waypoints go in one Directions request)
+    coords = [
+        [data["current_location"]["lng"], data["current_location"]["lat"]],
+        [data["pickup_location"]["lng"], data["pickup_location"]["lat"]],
+        [data["dropoff_location"]["lng"], data["dropoff_location"]["lat"]],
+    ]
 
-    try:
-        # 1. Extract coordinates
-        coords = [
-            [data["current_location"]["lng"], data["current_location"]["lat"]],
-            [data["pickup_location"]["lng"], data["pickup_location"]["lat"]],
-            [data["dropoff_location"]["lng"], data["dropoff_location"]["lat"]],
-        ]
-
-        # 2. Get your API key
-        ors_key = os.getenv("ORS_API_KEY")
-        if not ors_key:
-            return Response({"error": "ORS_API_KEY not found"}, status=500)
-
-        # 3. Call ORS Directions API
-        url = "https://api.openrouteservice.org/v2/directions/driving-car/geojson"
+    # 2. Get your API key
+    ors_key = os.getenv("ORS_API_KEY")
+    if not ors_key:
+        return None, Response({"error": "ORS_API_KEY not found"}, status=500)
+
+    # 3. Call ORS Directions API (skipped when the route is cached)
+    cache_key = route_cache_key(coords)
+    route_data = cached_route(cache_key)
+
+    if route_data is None:
+        # requests already sends "Accept-Encoding: gzip, deflate" and
+        # decompresses transparently, so the GeoJSON arrives compressed
         headers = {"Authorization": ors_key, "Content-Type": "application/json"}
         payload = {"coordinates": coords}
 
-        res = requests.post(url, json=payload, headers=headers)
+        try:
+            res = ors_session.post(
+                ORS_DIRECTIONS_URL, json=payload, headers=headers, timeout=ORS_TIMEOUT
+            )
+        except requests.RequestException as e:
+            if ors_timed_out(e):
+                logger.warning("ORS request timed out")
+                return None, HttpResponse(
+                    ORS_TIMEOUT_BODY, status=504, content_type="application/json"
+                )
+            logger.warning("ORS request failed: %s", e)
+            return None, HttpResponse(
+                ORS_UNREACHABLE_BODY, status=502, content_type="application/json"
+            )
+
         if res.status_code != 200:
-            print(res.text)
-            return Response({"error": "ORS request failed", "details": res.text}, status=500)
-
-        route_data = res.json()
-        
-        
-        schedule = compute_schedule_for_route(route_data, data.get("current_cycle_used_hours", 0))
-        
-        props = route_data["features"][0]["properties"]["segments"][0]
-        
+            logger.warning("ORS request failed (%s): %s", res.status_code, res.text)
+            return None, Response(
+                {"error": "ORS request failed", "details": res.text}, status=500
+            )
+
+        try:
+            route_data = orjson.loads(res.content)
+        except orjson.JSONDecodeError:
+            return None, malformed_route_response()
+        if route_segments(route_data) is not None:
+            cache_route(cache_key, route_data)
+
+    return route_data, None
+
+
+@api_view(["POST"])
+def plan_trip(request):
+    """
+    Plans a trip: the ORS route, a short summary of the first leg and the
+    HOS-compliant schedule.
+    """
+    data = request.data
+    logger.debug("Received trip data: %s", data)
+
+    try:
+        route_data, error = fetch_route(data)
+        if error is not None:
+            return error
+
+        segments = route_segments(route_data)
+        if segments is None:
+            return malformed_route_response()
+
+        props = segments[0]
+        total_meters, total_seconds = segment_totals(segments)
+
+        schedule = compute_schedule_for_route(
+            total_meters, props["distance"], total_seconds,
+            data.get("current_cycle_used_hours", 0),
+        )
+
         response_data = {
             "route": route_data,
             "summary": {
@@ -56,5 +229,39 @@ def plan_trip(request):
 
 
     except Exception as e:
-        print("Error:", e)
+        logger.error("Error: %s", e)
+        return Response({"error": str(e)}, status=500)
+
+
+@api_view(["POST"])
+def plan_trip_stream(request):
+    """
+    Same input as plan_trip, but streams only the schedule as NDJSON
+    (one entry per line) so timeline clients can render it as it arrives.
+    """
+    data = request.data
+    logger.debug("Received trip data: %s", data)
+
+    try:
+        route_data, error = fetch_route(data)
+        if error is not None:
+            return error
+
+        segments = route_segments(route_data)
+        if segments is None:
+            return malformed_route_response()
+
+        total_meters, _ = segment_totals(segments)
+
+        entries = iter_schedule(
+            total_meters, segments[0]["distance"],
+            data.get("current_cycle_used_hours", 0),
+        )
+        return StreamingHttpResponse(
+            (orjson.dumps(entry) + b"\n" for entry in entries),
+            content_type="application/x-ndjson",
+        )
+
+    except Exception as e:
+        logger.error("Error: %s", e)
         return Response({"error": str(e)}, status=500)